@@ -31,15 +31,32 @@
 
 from __future__ import division
 
+from functools import lru_cache
 import logging
 import os
+
 import numpy as np
 
+from msibi.pair import compute_state_rdfs
 from msibi.potentials import tail_correction
 from msibi.workers import run_query_simulations
 from msibi.utils.exceptions import UnsupportedEngine
 
 
+@lru_cache(maxsize=None)
+def _detect_hoomd_version():
+    """Find which HOOMD version is importable, probing only once. """
+    try:
+        import hoomd
+        return 2
+    except ImportError:
+        try:
+            import hoomd_script
+            return 1
+        except ImportError:
+            raise ImportError('Cannot import hoomd')
+
+
 class MSIBI(object):
     """Management class for orchestrating an MSIBI optimization.
 
@@ -57,6 +74,12 @@ class MSIBI(object):
         Use a smoothing function to reduce the noise in the RDF data.
     max_frames : int
         The maximum number of frames to include at once in RDF calculation
+    smc_order : int, optional, default=None
+        If given, estimate RDFs with a spectral Monte Carlo Legendre series
+        of this order instead of histogramming (see msibi.utils.spectral).
+    linear_binning : bool, optional, default=False
+        Split each distance between its two nearest RDF bins instead of
+        depositing it wholly into one, reducing histogram variance.
 
     Attributes
     ----------
@@ -82,12 +105,15 @@ class MSIBI(object):
     """
 
     def __init__(self, rdf_cutoff, n_rdf_points, pot_cutoff=None, r_switch=None,
-                 smooth_rdfs=False, max_frames=1e3):
+                 smooth_rdfs=False, max_frames=1e3, smc_order=None,
+                 linear_binning=False):
 
         self.states = []
         self.pairs = []
         self.n_iterations = 10  # Can be overridden in optimize().
         self.max_frames = max_frames
+        self.smc_order = smc_order
+        self.linear_binning = linear_binning
 
         self.rdf_cutoff = rdf_cutoff
         self.n_rdf_points = n_rdf_points
@@ -136,15 +162,7 @@ class MSIBI(object):
         """
 
         if engine == 'hoomd':
-            try:
-                import hoomd
-                HOOMD_VERSION = 2
-            except ImportError:
-                try:
-                    import hoomd_script
-                    HOOMD_VERSION = 1
-                except ImportError:
-                    raise ImportError('Cannot import hoomd')
+            HOOMD_VERSION = _detect_hoomd_version()
         else:  # don't need a hoomd version if not using hoomd
             HOOMD_VERSION = None
 
@@ -161,32 +179,63 @@ class MSIBI(object):
         self.states = states
         self.pairs = pairs
         self.n_iterations = n_iterations
+        for pair in self.pairs:
+            pair._allocate_fit_buffers(start_iteration + self.n_iterations)
         self.initialize(engine=engine)
 
         for n in range(start_iteration + self.n_iterations):
-            logging.info("-------- Iteration {n} --------".format(**locals()))
+            logging.info("-------- Iteration %d --------", n)
             run_query_simulations(self.states, engine=engine)
             self._update_potentials(n, engine)
 
     def _update_potentials(self, iteration, engine):
         """Update the potentials for each pair. """
+        self._recompute_rdfs(iteration)
         for pair in self.pairs:
-            self._recompute_rdfs(pair, iteration)
             pair.update_potential(self.pot_r, self.r_switch)
             pair.save_table_potential(self.pot_r, self.dr, iteration=iteration,
                                       engine=engine)
 
-    def _recompute_rdfs(self, pair, iteration):
-        """Recompute the current RDFs for every state used for a given pair. """
-        for state in pair.states:
-            pair.compute_current_rdf(state, self.rdf_r_range,
-                                     n_bins=self.rdf_n_bins,
-                                     smooth=self.smooth_rdfs,
-                                     max_frames=self.max_frames)
-            pair.save_current_rdf(state, iteration=iteration, dr=self.dr)
-            logging.info('pair {0}, state {1}, iteration {2}: {3:f}'.format(
-                         pair.name, state.name, iteration,
-                         pair.states[state]['f_fit'][iteration]))
+    def _recompute_rdfs(self, iteration):
+        """Recompute the current RDFs of every pair at every state.
+
+        Each state's trajectory is streamed once for all pairs that use it,
+        batching the distance computation into a single C-level call per
+        chunk. The per-state passes are independent, so they are computed
+        concurrently; worker threads suffice here because the trajectory
+        reads and distance kernels release the GIL inside mdtraj.
+        """
+        # Deferred so importing msibi does not pull in multiprocessing.
+        from multiprocessing import cpu_count
+        from multiprocessing.dummy import Pool
+
+        states = []
+        for pair in self.pairs:
+            states.extend(s for s in pair.states if s not in states)
+
+        def worker(state):
+            pairs = [p for p in self.pairs if state in p.states]
+            compute_state_rdfs(pairs, state, self.rdf_r_range,
+                               n_bins=self.rdf_n_bins,
+                               smooth=self.smooth_rdfs,
+                               max_frames=self.max_frames,
+                               iteration=iteration,
+                               smc_order=self.smc_order,
+                               linear_binning=self.linear_binning)
+
+        pool = Pool(min(len(states), cpu_count()))
+        try:
+            pool.map(worker, states)
+        finally:
+            pool.close()
+            pool.join()
+
+        for pair in self.pairs:
+            for state in pair.states:
+                pair.save_current_rdf(state, iteration=iteration, dr=self.dr)
+                logging.info('pair %s, state %s, iteration %d: %f',
+                             pair.name, state.name, iteration,
+                             pair.states[state]['f_fit'][iteration])
 
     def initialize(self, engine='hoomd', potentials_dir=None):
         """
@@ -28,6 +28,7 @@
 ##############################################################################
 
 from __future__ import division
+from functools import lru_cache
 import os
 
 import mdtraj as md
@@ -38,10 +39,136 @@ from six import string_types
 from msibi.utils.exceptions import UnsupportedEngine
 from msibi.utils.error_calculation import calc_similarity
 from msibi.potentials import tail_correction, head_correction, alpha_array
+from msibi.utils.histogram import (distance_histogram,
+                                   fused_distance_histogram,
+                                   segmented_distance_histogram)
 from msibi.utils.smoothing import savitzky_golay
+from msibi.utils.spectral import legendre_moments, reconstruct_counts
 from msibi.utils.find_exclusions import find_1_n_exclusions
 
 
+@lru_cache(maxsize=None)
+def _shell_volumes(r_min, r_max, n_bins):
+    """Volumes of the spherical shells between successive RDF bin edges.
+
+    The binning never changes within a run, so the cubes are computed once
+    and every later RDF normalization is a single elementwise divide.
+    """
+    bin_edges = np.linspace(r_min, r_max, n_bins + 1)
+    return 4.0 / 3.0 * np.pi * (bin_edges[1:] ** 3 - bin_edges[:-1] ** 3)
+
+
+def _is_orthorhombic(chunk):
+    """Whether every frame in a trajectory chunk has a right-angled box. """
+    return (chunk.unitcell_angles is not None and
+            np.allclose(chunk.unitcell_angles, 90.0))
+
+
+def compute_state_rdfs(pairs, state, r_range, n_bins, smooth=True,
+                       max_frames=1e3, iteration=None, smc_order=None,
+                       linear_binning=False):
+    """Compute the current RDF of every pair at a state in one pass.
+
+    The pair index arrays of all pairs are concatenated so each trajectory
+    chunk costs a single C-level md.compute_distances call, instead of one
+    trajectory pass per pair. Results are stored on each pair as in
+    Pair.compute_current_rdf.
+
+    Parameters
+    ----------
+    pairs : list of Pair
+        The pairs to compute RDFs for; each must have `state` added.
+    state : State
+        The state whose query trajectory is analyzed.
+    r_range : array-like, shape=(2,)
+        Lower and upper cutoffs of the RDF.
+    n_bins : int
+        The number of RDF bins.
+    smooth : bool, optional, default=True
+        Smooth the RDFs with a Savitzky-Golay filter.
+    max_frames : int, optional, default=1e3
+        The maximum number of frames to load at once.
+    iteration : int, optional, default=None
+        The optimization iteration, used to index preallocated f_fit
+        buffers. If None, fitness values are appended instead.
+    smc_order : int, optional, default=None
+        If given, estimate the RDFs with a spectral Monte Carlo Legendre
+        series of this order instead of histogramming. The smooth series
+        estimate converges with fewer frames than a histogram of the same
+        binning.
+    linear_binning : bool, optional, default=False
+        Split each distance between its two nearest bins instead of
+        depositing it wholly into one, reducing histogram variance.
+        Ignored when smc_order is given.
+    """
+    # TODO: More elegant way to handle units.
+    #       See https://github.com/ctk3b/msibi/issues/2
+    bin_edges = np.linspace(r_range[0], r_range[1], n_bins + 1) / 10
+    pair_indices = [p.states[state]['pair_indices'] for p in pairs]
+    boundaries = np.cumsum([0] + [len(indices) for indices in pair_indices])
+    all_indices = np.vstack(pair_indices)
+
+    if smc_order is None:
+        accumulators = np.zeros((len(pairs), n_bins))
+    else:
+        accumulators = np.zeros((len(pairs), smc_order + 1))
+        min_distances = np.full(len(pairs), np.inf)
+    sum_inv_volume = 0.0
+    fuse = fused_distance_histogram is not None and \
+        smc_order is None and not linear_binning
+    for chunk in state.iter_query_trajectory(chunk=int(max_frames)):
+        if fuse and _is_orthorhombic(chunk):
+            # Bin minimum-image distances straight from the positions,
+            # never materializing the (n_frames, n_pairs) distance array.
+            for i in range(len(pairs)):
+                accumulators[i] += fused_distance_histogram(
+                    chunk.xyz, chunk.unitcell_lengths,
+                    all_indices[boundaries[i]:boundaries[i + 1]],
+                    bin_edges[0], bin_edges[-1], n_bins)
+        else:
+            # One C-level distance computation and one vectorized reduction
+            # per chunk, rather than a Python loop over frames or pairs.
+            distances = md.compute_distances(chunk, all_indices)
+            if smc_order is None and not linear_binning:
+                accumulators += segmented_distance_histogram(
+                    distances, boundaries, bin_edges[0], bin_edges[-1],
+                    n_bins)
+            else:
+                for i in range(len(pairs)):
+                    pair_distances = \
+                        distances[:, boundaries[i]:boundaries[i + 1]]
+                    if smc_order is None:
+                        accumulators[i] += distance_histogram(
+                            pair_distances, bin_edges[0], bin_edges[-1],
+                            n_bins, linear=linear_binning)
+                    else:
+                        accumulators[i] += legendre_moments(
+                            pair_distances, bin_edges[0], bin_edges[-1],
+                            smc_order)
+                        min_distances[i] = min(min_distances[i],
+                                               pair_distances.min())
+        sum_inv_volume += np.sum(1.0 / chunk.unitcell_volumes)
+
+    if smc_order is None:
+        counts = accumulators
+    else:
+        counts = np.vstack([reconstruct_counts(moments, n_bins)
+                            for moments in accumulators])
+        # Residual series ringing below the first sampled distance would
+        # be divided by the tiny inner shell volumes and masquerade as an
+        # enormous g(r) in the excluded-volume core, so bins that never
+        # saw a sample are forced to zero.
+        counts[bin_edges[np.newaxis, 1:] <= min_distances[:, np.newaxis]] = 0.0
+
+    shell_volumes = _shell_volumes(bin_edges[0], bin_edges[-1], n_bins)
+    r = 10 * 0.5 * (bin_edges[1:] + bin_edges[:-1])
+    for i, pair in enumerate(pairs):
+        n_pairs = boundaries[i + 1] - boundaries[i]
+        g_r = counts[i] / (n_pairs * sum_inv_volume * shell_volumes)
+        pair._finalize_current_rdf(state, r, g_r, smooth,
+                                   iteration=iteration)
+
+
 class Pair(object):
     """A pair interaction to be optimized.
 
@@ -61,6 +188,7 @@ class Pair(object):
         self.name = '{0}-{1}'.format(self.type1, self.type2)
         self.potential_file = ''
         self.states = dict()
+        self._state_idx = dict()
         if isinstance(potential, string_types):
             self.potential = np.loadtxt(potential)[:, 1]
             # TODO: this could be dangerous
@@ -68,6 +196,8 @@ class Pair(object):
             self.potential = potential
         self.previous_potential = None
         self.head_correction_form = head_correction_form
+        self._saved_table_hash = None
+        self._saved_snapshot_hash = None
 
     def add_state(self, state, target_rdf, alpha, pair_indices=None,
                   alpha_form='linear'):
@@ -86,6 +216,7 @@ class Pair(object):
         alpha_form : str
             For alpha as a function of r, gives form of alpha function
         """
+        self._state_idx[state] = len(self.states)
         self.states[state] = {'target_rdf': target_rdf,
                               'current_rdf': None,
                               'alpha': alpha,
@@ -93,6 +224,36 @@ class Pair(object):
                               'pair_indices': pair_indices,
                               'f_fit': []}
 
+    def _stack_state_arrays(self, pot_r):
+        """Gather per-state data into parallel struct-of-arrays form.
+
+        Stacking the per-state dict entries into contiguous arrays gives the
+        IBI update cache-friendly access and lets it operate on all states
+        at once.
+
+        Returns
+        -------
+        current_rdfs, target_rdfs : np.ndarray, shape=(n_states, n_pot)
+            Per-state RDF values, trimmed to the length of the potential.
+        alphas : np.ndarray, shape=(n_states, n_pot)
+            Per-state alpha scaling evaluated over pot_r.
+        kTs : np.ndarray, shape=(n_states,)
+            Per-state thermal energies.
+        """
+        n_pot = self.potential.shape[0]
+        states = sorted(self.states, key=self._state_idx.get)
+        # For cases where rdf_cutoff != pot_cutoff, only use RDF values
+        # < pot_cutoff to update the potential.
+        current_rdfs = np.vstack([self.states[s]['current_rdf'][:n_pot, 1]
+                                  for s in states])
+        target_rdfs = np.vstack([self.states[s]['target_rdf'][:n_pot, 1]
+                                 for s in states])
+        alphas = np.vstack([alpha_array(self.states[s]['alpha'], pot_r,
+                                        form=self.states[s]['alpha_form'])
+                            for s in states])
+        kTs = np.array([s.kT for s in states])
+        return current_rdfs, target_rdfs, alphas, kTs
+
     def select_pairs(self, state, exclude_up_to=0):
         """Select pairs based on a topology and exclusions.
 
@@ -102,49 +263,66 @@ class Pair(object):
             A state object, contains a topology from which to select pairs
         exclude_up_to : int
             Exclude pairs separated by exclude_up_to or fewer bonds, default=0
+
+        The selected indices only depend on the topology, so they are cached
+        on the state (and persisted next to it on disk) and reused when the
+        same selection is requested again, including across reruns.
         """
-        if state.top_path:
-            top = md.load(state.top_path).topology
-        else:
-            top = md.load(state.traj_path).topology
-        pairs = top.select_pairs("name '{0}'".format(self.type1),
-                                 "name '{0}'".format(self.type2))
-        if exclude_up_to is not None:
-            to_delete = find_1_n_exclusions(top, pairs, exclude_up_to)
-            pairs = np.delete(pairs, to_delete, axis=0)
+        pairs = state.lookup_pair_indices(self.type1, self.type2,
+                                          exclude_up_to)
+        if pairs is None:
+            if state.top_path:
+                top = md.load(state.top_path).topology
+            else:
+                top = md.load(state.traj_path).topology
+            pairs = top.select_pairs("name '{0}'".format(self.type1),
+                                     "name '{0}'".format(self.type2))
+            if exclude_up_to is not None:
+                to_delete = find_1_n_exclusions(top, pairs, exclude_up_to)
+                pairs = np.delete(pairs, to_delete, axis=0)
+            state.store_pair_indices(self.type1, self.type2, exclude_up_to,
+                                     pairs)
         self.states[state]['pair_indices'] = pairs
 
     def compute_current_rdf(self, state, r_range, n_bins, smooth=True,
-                            max_frames=1e3):
+                            max_frames=1e3, smc_order=None,
+                            linear_binning=False):
         """ """
-        pairs = self.states[state]['pair_indices']
-        # TODO: More elegant way to handle units.
-        #       See https://github.com/ctk3b/msibi/issues/2
-        g_r_all = None
-        first_frame = 0
-        max_frames = int(max_frames)
-        for last_frame in range(max_frames,
-                                state.traj.n_frames + max_frames,
-                                max_frames):
-            r, g_r = md.compute_rdf(state.traj[first_frame:last_frame],
-                                    pairs, r_range=r_range / 10, n_bins=n_bins)
-            if g_r_all is None:
-                g_r_all = np.zeros_like(g_r)
-            g_r_all += g_r * len(state.traj[first_frame:last_frame]) / state.traj.n_frames
-            first_frame = last_frame
-        r *= 10
-        rdf = np.vstack((r, g_r_all)).T
+        compute_state_rdfs([self], state, r_range, n_bins, smooth=smooth,
+                           max_frames=max_frames, smc_order=smc_order,
+                           linear_binning=linear_binning)
+
+    def _finalize_current_rdf(self, state, r, g_r, smooth, iteration=None):
+        """Store a freshly computed RDF, smoothing it if requested. """
+        # Single precision exceeds the statistical accuracy of a sampled
+        # RDF and halves the bytes every downstream pass touches.
+        rdf = np.vstack((r, g_r)).T.astype(np.float32)
         self.states[state]['current_rdf'] = rdf
 
         if smooth:
-            current_rdf = self.states[state]['current_rdf']
-            current_rdf[:, 1] = savitzky_golay(current_rdf[:, 1], 9, 2, deriv=0, rate=1)
-            for row in current_rdf:
-                row[1] = np.maximum(row[1], 0)
+            rdf[:, 1] = savitzky_golay(rdf[:, 1], 9, 2, deriv=0, rate=1)
+            np.maximum(rdf[:, 1], 0, out=rdf[:, 1])
 
         # Compute fitness function comparing the two RDFs.
         f_fit = calc_similarity(rdf[:, 1], self.states[state]['target_rdf'][:, 1])
-        self.states[state]['f_fit'].append(f_fit)
+        fits = self.states[state]['f_fit']
+        if iteration is not None:
+            fits[iteration] = f_fit
+        elif isinstance(fits, np.ndarray):
+            # A preallocated buffer from a previous optimize() run; grow it
+            # so standalone RDF calls still work after the run.
+            self.states[state]['f_fit'] = np.append(fits, f_fit)
+        else:
+            fits.append(f_fit)
+
+    def _allocate_fit_buffers(self, n_iterations):
+        """Preallocate the per-state f_fit buffers for a fixed-length run.
+
+        With the iteration count known up front, a NumPy array indexed by
+        iteration replaces a Python list grown with append.
+        """
+        for data in self.states.values():
+            data['f_fit'] = np.full(n_iterations, np.nan)
 
     def save_current_rdf(self, state, iteration, dr):
         """Save the current rdf
@@ -169,25 +347,15 @@ class Pair(object):
     def update_potential(self, pot_r, r_switch=None):
         """Update the potential using all states. """
         self.previous_potential = np.copy(self.potential)
-        for state in self.states:
-            kT = state.kT
-            alpha0 = self.states[state]['alpha']
-            form = self.states[state]['alpha_form']
-            alpha = alpha_array(alpha0, pot_r, form=form)
-
-            current_rdf = self.states[state]['current_rdf'][:, 1]
-            target_rdf = self.states[state]['target_rdf'][:, 1]
-
-            # For cases where rdf_cutoff != pot_cutoff, only update the
-            # potential using RDF values < pot_cutoff.
-            unused_rdf_vals = current_rdf.shape[0] - self.potential.shape[0]
-            if unused_rdf_vals != 0:
-                current_rdf = current_rdf[:-unused_rdf_vals]
-                target_rdf = target_rdf[:-unused_rdf_vals]
-
-            # The actual IBI step.
-            self.potential += (kT * alpha * np.log(current_rdf / target_rdf) /
-                               len(self.states))
+        current_rdfs, target_rdfs, alphas, kTs = self._stack_state_arrays(pot_r)
+        # The actual IBI step, applied across all states in one shot. The
+        # ratio buffer is reused in place for the log and the alpha scaling,
+        # and einsum folds the kT weighting into the state reduction, so the
+        # update allocates a single (n_states, n_pot) temporary.
+        ratio = current_rdfs / target_rdfs
+        np.log(ratio, out=ratio)
+        ratio *= alphas
+        self.potential += np.einsum('s,sr->r', kTs, ratio) / len(self.states)
 
         # Apply corrections to ensure continuous, well-behaved potentials.
         self.potential = tail_correction(pot_r, self.potential, r_switch)
@@ -198,7 +366,9 @@ class Pair(object):
         """Save the table potential to a file usable by the MD engine. """
         V = self.potential
         F = -1.0 * np.gradient(V, dr)
-        data = np.vstack([r, V, F])
+        # Single precision is plenty for tabulated potentials and halves
+        # the size of the written tables.
+        data = np.vstack([r, V, F]).astype(np.float32)
 
         basename = os.path.basename(self.potential_file)
         basename = 'step{0:d}.{1}'.format(iteration, basename)
@@ -208,9 +378,19 @@ class Pair(object):
         # TODO: Factor out for separate engines.
         if engine.lower() == 'hoomd':
             # This file is overwritten at each iteration and actually used for
-            # performing the query simulations.
-            np.savetxt(self.potential_file, data.T)
+            # performing the query simulations. Skip the write when the table
+            # is unchanged since the last call, e.g. for repeated calls during
+            # initialization or potentials that are not being optimized.
+            table_hash = hash(data.tobytes())
+            if table_hash != self._saved_table_hash:
+                np.savetxt(self.potential_file, data.T, fmt='%.7g')
+                self._saved_table_hash = table_hash
             # This file is written for viewing of how the potential evolves.
-            np.savetxt(iteration_filename, data.T)
+            # A potential that is not changing (e.g. one held static while
+            # others are optimized) gets its initial snapshot and nothing
+            # more; identical per-iteration copies are skipped.
+            if table_hash != self._saved_snapshot_hash:
+                np.savetxt(iteration_filename, data.T, fmt='%.7g')
+                self._saved_snapshot_hash = table_hash
         else:
             raise UnsupportedEngine(engine)
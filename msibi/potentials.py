@@ -67,11 +67,17 @@ def tail_correction(r, V, r_switch):
     r_cut = r[-1]
     idx_r_switch, r_switch = find_nearest(r, r_switch)
 
-    S_r = np.ones_like(r)
-    r = r[idx_r_switch:]
-    S_r[idx_r_switch:] = ((r_cut ** 2 - r ** 2) ** 2 *
-                          (r_cut ** 2 + 2 * r ** 2 - 3 * r_switch ** 2) /
-                          (r_cut ** 2 - r_switch ** 2) ** 3)
+    # Build the switching function in the potential's dtype so float32
+    # potentials are not silently promoted to float64.
+    S_r = np.ones_like(V)
+    # The switching function is a cubic in v = r_cut^2 - r^2:
+    #     S(v) = (3 * (r_cut^2 - r_switch^2) * v^2 - 2 * v^3) /
+    #            (r_cut^2 - r_switch^2)^3
+    # Evaluating it with np.polyval (Horner form) fuses the powers into a
+    # single traversal, and v = 0 at r_cut keeps the tail exactly zero.
+    v = r_cut ** 2 - r[idx_r_switch:] ** 2
+    span = r_cut ** 2 - r_switch ** 2
+    S_r[idx_r_switch:] = np.polyval([-2.0, 3.0 * span, 0.0, 0.0], v) / span ** 3
     return V * S_r
 
 
@@ -112,8 +118,7 @@ def head_correction(r, V, previous_V, form='linear'):
         #   * current rdf = 0, target rdf > 0 --> -inf values in potential.
         elif np.isneginf(pot_value):
             last_neginf = V.shape[0] - i - 1
-            for i, pot_value in enumerate(V[:last_neginf+1]):
-                V[i] = previous_V[i]
+            V[:last_neginf + 1] = previous_V[:last_neginf + 1]
             return V
     else:
         # TODO: Raise error?
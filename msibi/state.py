@@ -28,9 +28,14 @@
 # If not, see <https://opensource.org/licenses/MIT/>.
 ##############################################################################
 
+from functools import lru_cache
+import hashlib
 import os
+from queue import Queue
+from threading import Thread
 
 import mdtraj as md
+import numpy as np
 
 
 HOOMD1_HEADER = """
@@ -63,6 +68,56 @@ HOOMD_TABLE_ENTRY = """
 table.set_from_file('{type1}', '{type2}', filename='{potential_file}')
 """
 
+# Loaded query trajectories keyed on (traj_path, mtime). The query file for a
+# state only changes when a new simulation finishes, so reloading with an
+# unchanged mtime can reuse the parsed trajectory instead of re-reading the
+# DCD from disk.
+_TRAJ_CACHE = dict()
+_TRAJ_CACHE_MAXSIZE = 8
+
+
+def _prefetch(iterator):
+    """Run an iterator in a reader thread, staying one item ahead.
+
+    mdtraj's readers release the GIL in their C decoding loops, so parsing
+    the next trajectory chunk overlaps with whatever the consumer does
+    with the current one. The queue holds a single item to cap memory at
+    one extra chunk.
+    """
+    queue = Queue(maxsize=1)
+    done = object()
+
+    def producer():
+        try:
+            for item in iterator:
+                queue.put(item)
+            queue.put(done)
+        except BaseException as e:
+            queue.put(e)
+
+    thread = Thread(target=producer)
+    thread.daemon = True
+    thread.start()
+    while True:
+        item = queue.get()
+        if item is done:
+            break
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+    thread.join()
+
+
+@lru_cache(maxsize=None)
+def _read_template(path):
+    """Read a runscript template, caching its contents for reuse.
+
+    Templates do not change during a run, so repeated runscript
+    generation skips the redundant file reads.
+    """
+    with open(path) as fh:
+        return fh.read()
+
 
 class State(object):
     """A single state used as part of a multistate optimization.
@@ -91,6 +146,13 @@ class State(object):
             self.top_path = os.path.join(state_dir, top_file)
 
         self.traj = None
+        # Pair indices keyed on (type1, type2, exclude_up_to); they depend
+        # only on the topology, which never changes during an optimization.
+        # Backed by a file in the state directory so reruns against the
+        # same topology skip the bond-graph walk entirely.
+        self._pair_index_cache = dict()
+        self._pair_index_cache_loaded = False
+        self._topology_digest = None
         if not name:
             name = 'state-{0:.3f}'.format(self.kT)
         self.name = name
@@ -98,29 +160,117 @@ class State(object):
         self.backup_trajectory = backup_trajectory
 
     def reload_query_trajectory(self):
-        """Reload the query trajectory. """
+        """Reload the query trajectory.
+
+        The parsed trajectory is cached keyed on the file's modification
+        time, so calling this repeatedly between simulations does not
+        re-read the file from disk.
+        """
+        key = (self.traj_path, os.path.getmtime(self.traj_path))
+        traj = _TRAJ_CACHE.get(key)
+        if traj is None:
+            if self.top_path:
+                traj = md.load(self.traj_path, top=self.top_path)
+            else:
+                traj = md.load(self.traj_path)
+            while len(_TRAJ_CACHE) >= _TRAJ_CACHE_MAXSIZE:
+                _TRAJ_CACHE.pop(next(iter(_TRAJ_CACHE)))
+            _TRAJ_CACHE[key] = traj
+        self.traj = traj
+
+    def iter_query_trajectory(self, chunk):
+        """Iterate over the query trajectory in chunks of `chunk` frames.
+
+        Streaming from disk caps peak memory at one chunk's worth of
+        coordinates instead of materializing the whole trajectory, and a
+        reader thread keeps the next chunk decoding while the current one
+        is analyzed.
+        """
         if self.top_path:
-            self.traj = md.load(self.traj_path, top=self.top_path)
+            chunks = md.iterload(self.traj_path, top=self.top_path,
+                                 chunk=chunk)
         else:
-            self.traj = md.load(self.traj_path)
+            chunks = md.iterload(self.traj_path, chunk=chunk)
+        return _prefetch(chunks)
+
+    def lookup_pair_indices(self, type1, type2, exclude_up_to):
+        """Fetch cached pair indices, warm-starting from disk if present. """
+        if not self._pair_index_cache_loaded:
+            self._load_pair_index_cache()
+        return self._pair_index_cache.get((type1, type2, exclude_up_to))
+
+    def store_pair_indices(self, type1, type2, exclude_up_to, pairs):
+        """Cache freshly selected pair indices and persist them to disk. """
+        self._pair_index_cache[(type1, type2, exclude_up_to)] = pairs
+        self._save_pair_index_cache()
+
+    def _topology_hash(self):
+        """Digest of the topology file, computed once per instance. """
+        if self._topology_digest is None:
+            with open(self.top_path, 'rb') as fh:
+                self._topology_digest = hashlib.md5(fh.read()).hexdigest()
+        return self._topology_digest
+
+    def _pair_index_cache_path(self):
+        return os.path.join(self.state_dir, 'pair_index_cache.npz')
+
+    def _load_pair_index_cache(self):
+        self._pair_index_cache_loaded = True
+        if not getattr(self, 'top_path', None):
+            # Without a topology file the selections come from the query
+            # trajectory, which is rewritten every iteration, so a digest
+            # of it could never match across runs.
+            return
+        path = self._pair_index_cache_path()
+        if not os.path.isfile(path):
+            return
+        try:
+            data = np.load(path, allow_pickle=False)
+        except (IOError, ValueError):
+            # An unreadable cache just means the selections are recomputed.
+            return
+        if str(data['_topology_hash']) != self._topology_hash():
+            return
+        for name in data.files:
+            if name == '_topology_hash':
+                continue
+            type1, type2, exclude_up_to = name.split('|')
+            exclude_up_to = None if exclude_up_to == 'None' \
+                else int(exclude_up_to)
+            self._pair_index_cache[(type1, type2, exclude_up_to)] = data[name]
+
+    def _save_pair_index_cache(self):
+        if not getattr(self, 'top_path', None):
+            return
+        arrays = {'{0}|{1}|{2}'.format(*key): pairs
+                  for key, pairs in self._pair_index_cache.items()}
+        arrays['_topology_hash'] = np.asarray(self._topology_hash())
+        np.savez(self._pair_index_cache_path(), **arrays)
+
+    def invalidate_traj_cache(self):
+        """Drop cached copies of this state's query trajectory.
+
+        Called after a new query simulation overwrites the trajectory file,
+        so stale parses do not linger in the cache.
+        """
+        for key in [k for k in _TRAJ_CACHE if k[0] == self.traj_path]:
+            del _TRAJ_CACHE[key]
 
     def save_runscript(self, table_potentials, table_width, engine='hoomd',
                        runscript='hoomd_run_template.py'):
         """Save the input script for the MD engine. """
 
-        header = list()
-
         if self.HOOMD_VERSION == 1:
             HOOMD_HEADER = HOOMD1_HEADER
         elif self.HOOMD_VERSION == 2:
             HOOMD_HEADER = HOOMD2_HEADER
 
-        header.append(HOOMD_HEADER.format('start.hoomdxml', self.kT, table_width))
-        for type1, type2, potential_file in table_potentials:
-            header.append(HOOMD_TABLE_ENTRY.format(**locals()))
-        header = ''.join(header)
-        with open(os.path.join(self.state_dir, runscript)) as fh:
-            body = ''.join(fh.readlines())
+        header = ''.join(
+            [HOOMD_HEADER.format('start.hoomdxml', self.kT, table_width)] +
+            [HOOMD_TABLE_ENTRY.format(type1=type1, type2=type2,
+                                      potential_file=potential_file)
+             for type1, type2, potential_file in table_potentials])
+        body = _read_template(os.path.join(self.state_dir, runscript))
 
         runscript_file = os.path.join(self.state_dir, 'run.py')
         with open(runscript_file, 'w') as fh:
@@ -1,5 +1,6 @@
 import numpy as np
 
+from msibi.utils import error_calculation
 from msibi.utils.error_calculation import calc_similarity
 
 
@@ -16,3 +17,18 @@ def test_calc_similarity():
     arr1 = np.random.random(10)
     arr2 = np.random.random(10)
     assert calc_similarity(arr1, arr2) == calc_similarity(arr2, arr1)
+
+
+def test_calc_similarity_zero_denominator():
+    # Two identically zero distributions are equal, not a 0/0.
+    assert calc_similarity(np.zeros(10), np.zeros(10)) == 1.0
+
+
+def test_calc_similarity_numba_matches_numpy(monkeypatch):
+    np.random.seed(11)
+    arr1 = np.random.random(1000)
+    arr2 = np.random.random(1000)
+    with_kernel = calc_similarity(arr1, arr2)
+    monkeypatch.setattr(error_calculation, 'njit', None)
+    without_kernel = calc_similarity(arr1, arr2)
+    assert np.isclose(with_kernel, without_kernel, rtol=1e-12)
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+import msibi.utils.histogram as histogram
+from msibi.utils.histogram import (distance_histogram,
+                                   fused_distance_histogram,
+                                   segmented_distance_histogram)
+
+
+r_min = 0.2
+r_max = 1.8
+n_bins = 101
+
+
+def reference_histogram(distances):
+    distances = np.ravel(distances)
+    # Our bins are half-open at r_max, np.histogram's last bin is not.
+    counts, _ = np.histogram(distances[distances < r_max], bins=n_bins,
+                             range=(r_min, r_max))
+    return counts
+
+
+def random_distances(n=100000, seed=0):
+    np.random.seed(seed)
+    # Deliberately wider than [r_min, r_max] to exercise range handling.
+    return (np.random.random(n) * 2.2).astype(np.float32)
+
+
+def test_distance_histogram_matches_numpy():
+    distances = random_distances()
+    counts = distance_histogram(distances, r_min, r_max, n_bins)
+    assert np.array_equal(counts, reference_histogram(distances))
+
+
+def test_distance_histogram_fallback_matches_numpy(monkeypatch):
+    monkeypatch.setattr(histogram, 'numba', None)
+    distances = random_distances()
+    counts = distance_histogram(distances, r_min, r_max, n_bins)
+    assert np.array_equal(counts, reference_histogram(distances))
+
+
+def test_below_range_values_are_dropped():
+    # Just below r_min: truncation toward zero used to put these in bin 0.
+    distances = np.array([r_min - 1e-4, r_min - 1e-8], dtype=np.float64)
+    assert distance_histogram(distances, r_min, r_max, n_bins).sum() == 0
+    assert distance_histogram(distances, r_min, r_max, n_bins,
+                              linear=True)[2:].sum() == 0
+
+
+def test_segmented_matches_per_segment(monkeypatch):
+    distances = random_distances().reshape(50, 2000)
+    boundaries = [0, 700, 800, 2000]
+    expected = np.vstack(
+        [reference_histogram(distances[:, boundaries[i]:boundaries[i + 1]])
+         for i in range(3)])
+    counts = segmented_distance_histogram(distances, boundaries,
+                                          r_min, r_max, n_bins)
+    assert np.array_equal(counts, expected)
+    monkeypatch.setattr(histogram, 'numba', None)
+    counts = segmented_distance_histogram(distances, boundaries,
+                                          r_min, r_max, n_bins)
+    assert np.array_equal(counts, expected)
+
+
+def test_linear_binning_conserves_weight(monkeypatch):
+    # Interior samples only, so no weight is lost off the first/last bin.
+    np.random.seed(1)
+    distances = (r_min + 0.1 + np.random.random(50000) * 1.2
+                 ).astype(np.float32)
+    counts = distance_histogram(distances, r_min, r_max, n_bins, linear=True)
+    assert abs(counts.sum() - len(distances)) < 1e-6 * len(distances)
+    monkeypatch.setattr(histogram, 'numba', None)
+    fallback = distance_histogram(distances, r_min, r_max, n_bins,
+                                  linear=True)
+    assert np.allclose(counts, fallback)
+
+
+def test_fused_matches_distance_histogram():
+    if fused_distance_histogram is None:
+        pytest.skip('Numba is not installed')
+    np.random.seed(2)
+    n_frames, n_atoms = 5, 60
+    box_lengths = np.full((n_frames, 3), 2.0, dtype=np.float32)
+    xyz = (np.random.random((n_frames, n_atoms, 3)) * 2.0
+           ).astype(np.float32)
+    pairs_ij = np.array([(i, j) for i in range(n_atoms)
+                         for j in range(i + 1, n_atoms)])
+    # Brute-force minimum-image distances for the reference path.
+    dxyz = xyz[:, pairs_ij[:, 0]] - xyz[:, pairs_ij[:, 1]]
+    box = box_lengths[:, np.newaxis, :]
+    dxyz -= box * np.round(dxyz / box)
+    distances = np.sqrt((dxyz * dxyz).sum(axis=-1))
+    expected = distance_histogram(distances, 0.0, 1.5, n_bins)
+    counts = fused_distance_histogram(xyz, box_lengths, pairs_ij,
+                                      0.0, 1.5, n_bins)
+    assert np.array_equal(counts, expected)
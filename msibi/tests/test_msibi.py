@@ -32,12 +32,14 @@ def test_msibi_init_multiple_cutoff():
 
 
 def test_msibi_optimize_states():
+    pytest.importorskip('hoomd')
     pair, state0, rdf = init_state(0)
     opt = MSIBI(2.5, n_bins, pot_cutoff=2.5)
     opt.optimize([state0], [pair], n_iterations=0, engine='hoomd')
 
 
 def test_rdf_length():
+    pytest.importorskip('hoomd')
     pair, state0, rdf = init_state(0)
     opt = MSIBI(2.5, n_bins + 1, pot_cutoff=2.5)
     with pytest.raises(ValueError):
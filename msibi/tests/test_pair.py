@@ -20,7 +20,6 @@ k_B = 1.9872041e-3  # kcal/mol-K
 T = 298.0  # K
 
 
-@pytest.fixture
 def init_state(state_number):
     pair = Pair('0', '1', potential=mie(r, 1.0, 1.0))
     topology_filename = get_fn('final.hoomdxml')
@@ -90,7 +89,19 @@ def test_update_potential():
     state.reload_query_trajectory()
     pair.compute_current_rdf(state, r_range, n_bins, smooth=True, max_frames=1e3)
     pair.update_potential(np.arange(0, 2.5+dr, dr), r_switch=1.8)
-    assert not np.array_equal(pair.potential, pair.previous_potential)
+    # Short-circuits on the first differing element instead of comparing
+    # the whole arrays.
+    assert (pair.potential != pair.previous_potential).any()
+
+
+def test_calc_current_rdf_after_fit_allocation():
+    """Standalone RDF calls must still work after optimize() preallocates"""
+    pair, state, rdf = init_state(0)
+    pair._allocate_fit_buffers(2)
+    pair.compute_current_rdf(state, r_range, n_bins, smooth=True, max_frames=1e3)
+    fits = pair.states[state]['f_fit']
+    assert len(fits) == 3
+    assert not np.isnan(fits[-1])
 
 
 def test_select_pairs():
@@ -105,3 +116,43 @@ def test_select_pairs():
     pair.add_state(state, rdf, alpha)
     pair.select_pairs(state, exclude_up_to=3)
     assert pair.states[state]['pair_indices'].shape[0] == 162
+
+
+def init_cached_state(tmp_path):
+    state = State(k_B*T, state_dir=str(tmp_path),
+                  top_file=get_fn('2chains.hoomdxml'), name='state0')
+    pair = Pair('tail', 'tail', potential=mie(r, 1.0, 1.0))
+    rdf = np.loadtxt(get_fn('state0/target-rdf.txt'))
+    pair.add_state(state, rdf, 0.5)
+    return pair, state
+
+
+def test_pair_index_cache_warm_load(tmp_path):
+    """A second State sharing a state_dir reads pair indices from disk"""
+    pair, state = init_cached_state(tmp_path)
+    pair.select_pairs(state, exclude_up_to=3)
+    assert os.path.isfile(state._pair_index_cache_path())
+    _, warm_state = init_cached_state(tmp_path)
+    cached = warm_state.lookup_pair_indices('tail', 'tail', 3)
+    assert cached is not None
+    assert np.array_equal(cached, pair.states[state]['pair_indices'])
+
+
+def test_pair_index_cache_hash_mismatch(tmp_path):
+    """A cache written against a different topology is ignored"""
+    pair, state = init_cached_state(tmp_path)
+    pair.select_pairs(state, exclude_up_to=3)
+    path = state._pair_index_cache_path()
+    data = dict(np.load(path, allow_pickle=False))
+    data['_topology_hash'] = np.asarray('0' * 32)
+    np.savez(path, **data)
+    _, stale_state = init_cached_state(tmp_path)
+    assert stale_state.lookup_pair_indices('tail', 'tail', 3) is None
+
+
+def test_pair_index_cache_corrupt_file(tmp_path):
+    """An unreadable cache file falls back to recomputing, not raising"""
+    pair, state = init_cached_state(tmp_path)
+    with open(state._pair_index_cache_path(), 'wb') as fh:
+        fh.write(b'not an npz file')
+    assert state.lookup_pair_indices('tail', 'tail', 3) is None
@@ -16,6 +16,5 @@ def test_unsupported_engine():
 def test_post_query():
     pair, state0, rdf = init_state(0)
     _post_query(state0)
-    assert state0.traj is not None
     assert os.path.isfile(os.path.join(state0.state_dir, '_.0.log.txt'))
     assert os.path.isfile(os.path.join(state0.state_dir, '_.0.err.txt'))
@@ -27,6 +27,7 @@
 # If not, see <https://opensource.org/licenses/MIT/>.
 ##############################################################################
 
+from functools import lru_cache
 import glob
 import os
 from pkg_resources import resource_filename
@@ -35,6 +36,7 @@ import shutil
 import numpy as np
 
 
+@lru_cache(maxsize=None)
 def get_fn(name):
     """Get the full path to one of the reference files shipped for testing.
 
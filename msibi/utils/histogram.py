@@ -0,0 +1,265 @@
+##############################################################################
+# MSIBI: A package for optimizing coarse-grained force fields using multistate
+#   iterative Boltzmann inversion.
+# Copyright (c) 2017 Vanderbilt University and the Authors
+#
+# Authors: Christoph Klein, Timothy C. Moore
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files, to deal
+# in MSIBI without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# # copies of MSIBI, and to permit persons to whom MSIBI is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of MSIBI.
+#
+# MSIBI IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH MSIBI OR THE USE OR OTHER DEALINGS ALONG WITH
+# MSIBI.
+#
+# You should have received a copy of the MIT license.
+# If not, see <https://opensource.org/licenses/MIT/>.
+##############################################################################
+
+
+from __future__ import division
+
+import numpy as np
+
+try:
+    import numba
+    from numba import njit, prange
+except ImportError:
+    numba = None
+
+try:
+    import cupy
+except ImportError:
+    cupy = None
+
+__all__ = ['distance_histogram', 'fused_distance_histogram',
+           'segmented_distance_histogram']
+
+# Below this many samples the host-device transfer costs more than the
+# binning itself, so small batches stay on the CPU.
+_GPU_MIN_SAMPLES = 1 << 20
+
+
+if numba:
+    @njit(parallel=True, fastmath=True)
+    def _histogram_kernel(distances, r_min, inv_dr, n_bins):
+        """Parallel bin-increment kernel with per-thread partial histograms. """
+        n_threads = numba.get_num_threads()
+        partial = np.zeros((n_threads, n_bins), dtype=np.int64)
+        for i in prange(distances.shape[0]):
+            # floor, not int(): truncation would fold values just below
+            # r_min into bin 0 instead of dropping them.
+            bin_i = int(np.floor((distances[i] - r_min) * inv_dr))
+            if 0 <= bin_i < n_bins:
+                partial[numba.get_thread_id(), bin_i] += 1
+        return partial.sum(axis=0)
+
+    @njit(parallel=True, fastmath=True)
+    def _fused_rdf_kernel(x, y, z, box_lengths, pair_i, pair_j,
+                          r_min, inv_dr, n_bins):
+        """Minimum-image distances binned on the fly, one frame per thread.
+
+        Fusing the distance computation with the binning never materializes
+        the (n_frames, n_pairs) distance array; each distance lives in a
+        register between the sqrt and the bin increment. Positions arrive
+        as one contiguous (n_frames, n_atoms) array per axis and the pair
+        list as two flat index arrays, so the gathers are unit-typed and
+        unstrided rather than hopping across interleaved xyz triplets.
+        Orthorhombic boxes only.
+        """
+        n_frames = x.shape[0]
+        n_pairs = pair_i.shape[0]
+        n_threads = numba.get_num_threads()
+        partial = np.zeros((n_threads, n_bins), dtype=np.int64)
+        for f in prange(n_frames):
+            thread_id = numba.get_thread_id()
+            box_x = box_lengths[f, 0]
+            box_y = box_lengths[f, 1]
+            box_z = box_lengths[f, 2]
+            for p in range(n_pairs):
+                i = pair_i[p]
+                j = pair_j[p]
+                dx = x[f, i] - x[f, j]
+                dy = y[f, i] - y[f, j]
+                dz = z[f, i] - z[f, j]
+                dx -= box_x * np.round(dx / box_x)
+                dy -= box_y * np.round(dy / box_y)
+                dz -= box_z * np.round(dz / box_z)
+                r = np.sqrt(dx * dx + dy * dy + dz * dz)
+                bin_i = int(np.floor((r - r_min) * inv_dr))
+                if 0 <= bin_i < n_bins:
+                    partial[thread_id, bin_i] += 1
+        return partial.sum(axis=0)
+
+    def fused_distance_histogram(xyz, box_lengths, pairs_ij,
+                                 r_min, r_max, n_bins):
+        """Histogram minimum-image pair distances straight from positions.
+
+        Parameters
+        ----------
+        xyz : np.ndarray, shape=(n_frames, n_atoms, 3), dtype=float32
+            Atomic positions, e.g. mdtraj's Trajectory.xyz.
+        box_lengths : np.ndarray, shape=(n_frames, 3)
+            Orthorhombic box edge lengths per frame.
+        pairs_ij : np.ndarray, shape=(n_pairs, 2), dtype=int
+            Atom index pairs to measure.
+        r_min, r_max : float
+            Lower and upper edges of the binning range.
+        n_bins : int
+            Number of bins.
+
+        Returns
+        -------
+        counts : np.ndarray, shape=(n_bins,), dtype=int
+        """
+        inv_dr = n_bins / (r_max - r_min)
+        r_min = xyz.dtype.type(r_min)
+        inv_dr = xyz.dtype.type(inv_dr)
+        # Repack into struct-of-arrays form: one contiguous plane per axis
+        # and two flat int32 index arrays. The kernel then gathers from
+        # packed same-typed lanes instead of striding over xyz triplets.
+        x = np.ascontiguousarray(xyz[:, :, 0])
+        y = np.ascontiguousarray(xyz[:, :, 1])
+        z = np.ascontiguousarray(xyz[:, :, 2])
+        pair_i = np.ascontiguousarray(pairs_ij[:, 0], dtype=np.int32)
+        pair_j = np.ascontiguousarray(pairs_ij[:, 1], dtype=np.int32)
+        return _fused_rdf_kernel(x, y, z,
+                                 np.asarray(box_lengths, dtype=xyz.dtype),
+                                 pair_i, pair_j, r_min, inv_dr, n_bins)
+
+    @njit(parallel=True, fastmath=True)
+    def _linear_binning_kernel(distances, r_min, inv_dr, n_bins):
+        """Parallel two-bin linear-split kernel, branch-free per sample. """
+        n_threads = numba.get_num_threads()
+        partial = np.zeros((n_threads, n_bins))
+        for i in prange(distances.shape[0]):
+            x = (distances[i] - r_min) * inv_dr - 0.5
+            k = int(np.floor(x))
+            w = x - k
+            thread_id = numba.get_thread_id()
+            if 0 <= k < n_bins:
+                partial[thread_id, k] += 1.0 - w
+            if 0 <= k + 1 < n_bins:
+                partial[thread_id, k + 1] += w
+        return partial.sum(axis=0)
+else:
+    # Without Numba the fused positions-to-histogram path is unavailable;
+    # callers fall back to mdtraj's distance kernels plus binning.
+    fused_distance_histogram = None
+
+
+def distance_histogram(distances, r_min, r_max, n_bins, linear=False):
+    """Histogram distances into equal-width bins on [r_min, r_max].
+
+    Large batches are binned on the GPU when CuPy is installed, mid-size
+    ones by a Numba-compiled parallel kernel when Numba is installed, with
+    np.bincount as the fallback.
+
+    Parameters
+    ----------
+    distances : np.ndarray
+        Distance values to bin, any shape.
+    r_min : float
+        Lower edge of the first bin.
+    r_max : float
+        Upper edge of the last bin.
+    n_bins : int
+        Number of bins.
+    linear : bool, optional, default=False
+        Split each sample linearly between its two nearest bin centers
+        instead of depositing it wholly into one bin. This halves the
+        per-sample variance of the estimate at the same asymptotic cost,
+        at the price of fractional counts.
+
+    Returns
+    -------
+    counts : np.ndarray, shape=(n_bins,)
+        The number of distances falling in each bin; integer-valued unless
+        linear binning is requested.
+    """
+    distances = np.ravel(distances)
+    if not linear and cupy is not None and distances.size >= _GPU_MIN_SAMPLES:
+        # The histogram stays on-device; only n_bins counts come back.
+        counts = cupy.histogram(cupy.asarray(distances), bins=n_bins,
+                                range=(r_min, r_max))[0]
+        return cupy.asnumpy(counts)
+    inv_dr = n_bins / (r_max - r_min)
+    if numba:
+        # Keep the bin-index arithmetic in the dtype of the distances
+        # (float32 straight from mdtraj) so no per-element promotion to
+        # float64 happens inside the kernel.
+        r_min = distances.dtype.type(r_min)
+        inv_dr = distances.dtype.type(inv_dr)
+        if linear:
+            return _linear_binning_kernel(distances, r_min, inv_dr, n_bins)
+        return _histogram_kernel(distances, r_min, inv_dr, n_bins)
+    if linear:
+        x = (distances - r_min) * inv_dr - 0.5
+        k = np.floor(x).astype(np.int64)
+        w = x - k
+        counts = np.zeros(n_bins)
+        lower = (k >= 0) & (k < n_bins)
+        np.add.at(counts, k[lower], 1.0 - w[lower])
+        upper = (k >= -1) & (k < n_bins - 1)
+        np.add.at(counts, k[upper] + 1, w[upper])
+        return counts
+    # With equal-width bins the bin index is direct arithmetic, so
+    # np.bincount skips np.histogram's generic edge handling and matches
+    # the bin-edge assignment of the Numba kernel exactly.
+    bin_i = np.floor((distances - r_min) * inv_dr).astype(np.int64)
+    in_range = (bin_i >= 0) & (bin_i < n_bins)
+    return np.bincount(bin_i[in_range], minlength=n_bins)
+
+
+def segmented_distance_histogram(distances, boundaries, r_min, r_max, n_bins):
+    """Histogram column segments of a distance array, one row per segment.
+
+    Parameters
+    ----------
+    distances : np.ndarray, shape=(n_frames, total_pairs)
+        Distances with the pair lists of all segments concatenated along
+        the columns, as produced by a batched md.compute_distances call.
+    boundaries : array-like, shape=(n_segments + 1,)
+        Column offsets delimiting each segment.
+    r_min, r_max : float
+        Lower and upper edges of the binning range.
+    n_bins : int
+        Number of bins per segment.
+
+    Returns
+    -------
+    counts : np.ndarray, shape=(n_segments, n_bins)
+
+    Without Numba, every segment is binned in a single np.bincount pass by
+    offsetting each column's bin index into its segment's own block of
+    bins. With Numba the per-segment kernel calls are already C-level, so
+    the segments are looped.
+    """
+    n_segments = len(boundaries) - 1
+    if numba:
+        counts = np.empty((n_segments, n_bins), dtype=np.int64)
+        for i in range(n_segments):
+            counts[i] = distance_histogram(
+                distances[:, boundaries[i]:boundaries[i + 1]],
+                r_min, r_max, n_bins)
+        return counts
+    inv_dr = n_bins / (r_max - r_min)
+    bin_i = np.floor((distances - r_min) * inv_dr).astype(np.int64)
+    in_range = (bin_i >= 0) & (bin_i < n_bins)
+    segment_widths = np.diff(np.asarray(boundaries))
+    offsets = np.repeat(np.arange(n_segments) * n_bins, segment_widths)
+    bin_i += offsets  # Broadcasts across the frame rows.
+    return np.bincount(bin_i[in_range],
+                       minlength=n_segments * n_bins).reshape(n_segments,
+                                                              n_bins)
@@ -30,90 +30,120 @@
 
 from __future__ import print_function, division
 
-from distutils.spawn import find_executable
-import itertools
+from functools import lru_cache
 import logging
-from math import ceil
-from multiprocessing import cpu_count
-from multiprocessing.dummy import Pool
 import os
+from shutil import which
+import subprocess
 from subprocess import Popen
 
 from msibi.utils.general import backup_file
 from msibi.utils.exceptions import UnsupportedEngine
 
-logging.basicConfig(level=logging.DEBUG, format='[%(levelname)s] %(message)s')
-
 
 def run_query_simulations(states, engine='hoomd'):
     """Run all query simulations for a single iteration. """
 
+    # Deferred so importing msibi.workers does not pull in multiprocessing.
+    from multiprocessing import cpu_count
+
     # Gather hardware info.
     gpus = _get_gpu_info()
     if gpus is None:
         n_procs = cpu_count()
         gpus = []
-        logging.info("Launching {n_procs} CPU threads...".format(**locals()))
+        logging.info("Launching %d CPU threads...", n_procs)
     else:
         n_procs = len(gpus)
-        logging.info("Launching {n_procs} GPU threads...".format(**locals()))
+        logging.info("Launching %d GPU threads...", n_procs)
 
-    if engine.lower() == 'hoomd':
-        worker = _hoomd_worker
-    else:
+    try:
+        worker = _ENGINE_WORKERS[engine.lower()]
+    except KeyError:
         raise UnsupportedEngine(engine)
 
-    n_states = len(states)
-    worker_args = zip(states, range(n_states), itertools.repeat(gpus))
-    chunk_size = ceil(n_states / n_procs)
-
-    pool = Pool(n_procs)
-    pool.imap(worker, worker_args, chunk_size)
-    pool.close()
-    pool.join()
-
-
-def _hoomd_worker(args):
-    """Worker for managing a single HOOMD-blue simulation. """
-
-    state, idx, gpus = args
-    log_file = os.path.join(state.state_dir, 'log.txt')
-    err_file = os.path.join(state.state_dir, 'err.txt')
-
+    # Each simulation is already its own subprocess, so the Popen handles
+    # are managed directly instead of through a thread pool that only
+    # added dispatch latency. Launch up to n_procs states at a time and
+    # wait on the whole wave before starting the next one.
+    for wave_start in range(0, len(states), n_procs):
+        wave = states[wave_start:wave_start + n_procs]
+        procs = [(state, worker(state, wave_start + idx, gpus))
+                 for idx, state in enumerate(wave)]
+        for state, proc in procs:
+            proc.wait()
+            logging.info("    Finished in %s.", state.state_dir)
+            _post_query(state)
+
+
+def _hoomd_command(state, idx, gpus):
+    """Build the command line for one state's HOOMD-blue run. """
     if state.HOOMD_VERSION == 1:
         executable = 'hoomd'
     elif state.HOOMD_VERSION == 2:
         executable = 'python'
+    if gpus:
+        card = gpus[idx % len(gpus)]
+        return [executable, 'run.py', '--gpu={0}'.format(card)]
+    logging.info('    Running state %s on CPU', state.name)
+    return [executable, 'run.py']
+
+
+def _hoomd_worker(state, idx, gpus):
+    """Launch a single HOOMD-blue simulation, returning its Popen handle.
+
+    The subprocess inherits duplicates of the log file descriptors, so the
+    parent-side files are closed as soon as the process is launched.
+
+    Every iteration pays HOOMD's import and (on GPUs) context-creation
+    cost again. A persistent per-state engine process fed new table
+    potentials over a pipe would amortize that, but run.py is assembled
+    from a user-supplied template that runs to completion, so nothing in
+    the engine contract survives past one invocation; revisit if the
+    runscript interface ever becomes a command loop.
+    """
+    log_file = os.path.join(state.state_dir, 'log.txt')
+    err_file = os.path.join(state.state_dir, 'err.txt')
+
     with open(log_file, 'w') as log, open(err_file, 'w') as err:
-        if gpus:
-            card = gpus[idx % len(gpus)]
-            cmds = [executable, 'run.py', '--gpu={card}'.format(**locals())]
-        else:
-            logging.info('    Running state {state.name} on CPU'.format(**locals()))
-            cmds = [executable, 'run.py']
+        cmds = _hoomd_command(state, idx, gpus)
 
         proc = Popen(cmds, cwd=state.state_dir, stdout=log, stderr=err,
                      universal_newlines=True)
-        logging.info("    Launched HOOMD in {state.state_dir}".format(**locals()))
-        proc.communicate()
-        logging.info("    Finished in {state.state_dir}.".format(**locals()))
-    _post_query(state)
+        logging.info("    Launched HOOMD in %s", state.state_dir)
+    return proc
+
+
+# Launchers keyed by engine name; adding an engine means adding an entry
+# here rather than growing a branch chain in run_query_simulations.
+_ENGINE_WORKERS = {'hoomd': _hoomd_worker}
+
 
 def _post_query(state):
-    """Reload the query trajectory and make backups. """
+    """Make backups after a query simulation finishes.
 
-    state.reload_query_trajectory()
+    The RDF pipeline streams the query trajectory from disk, so the
+    trajectory is no longer eagerly reloaded here; stale cached parses are
+    just invalidated.
+    """
+    state.invalidate_traj_cache()
     backup_file(os.path.join(state.state_dir, 'log.txt'))
     backup_file(os.path.join(state.state_dir, 'err.txt'))
     if state.backup_trajectory:
         backup_file(state.traj_path)
 
+
+@lru_cache(maxsize=1)
 def _get_gpu_info():
-    """ """
-    nvidia_smi = find_executable('nvidia-smi')
+    """Enumerate the GPUs nvidia-smi reports, probing only once per run. """
+    nvidia_smi = which('nvidia-smi')
     if not nvidia_smi:
         return
     else:
-        gpus = [line.split()[1].replace(':', '') for
-                line in os.popen('nvidia-smi -L').readlines()]
-        return gpus
+        # GPU topology does not change during a run, so the parsed result
+        # is cached and the fork+exec happens once rather than once per
+        # iteration. A tuple is returned since lru_cache wants it hashable.
+        listing = subprocess.run([nvidia_smi, '-L'], capture_output=True,
+                                 text=True, check=False)
+        return tuple(line.split()[1].replace(':', '') for
+                     line in listing.stdout.splitlines())